@@ -5,6 +5,9 @@ Anonimizador de identificadores latinoamericanos
 
 • Reemplaza cualquier ID reconocido por la etiqueta <ID>,
 manteniendo la longitud del texto para no desalinear offsets.
+• Dígitos, bordes de palabra y espacios se evalúan en ASCII; como
+separador se aceptan además U+00A0 y U+202F, pero no otros espacios
+Unicode (p. ej. U+2009).
 • Permite trabajar con datasets Hugging Face o un dataset de demostración.
 
 Licencia: CC BY-NC-ND 4.0
@@ -13,82 +16,313 @@ Licencia: CC BY-NC-ND 4.0
 from __future__ import annotations
 
 import argparse
+import os
 import re
-from typing import Dict, List, Tuple
+import time
+from bisect import bisect_right
+from typing import Any, Dict, FrozenSet, List, Tuple
 
+import pyarrow as pa
+import pyarrow.compute as pc
 from datasets import Dataset, load_from_disk
 
+try:  # escaneo multipatrón vectorizado (opcional): pip install hyperscan
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+try:  # motor DFA de tiempo lineal (opcional): pip install google-re2
+    import re2
+except ImportError:
+    re2 = None
+
 # --------------------------------------------------------------------------- #
 # Expresiones regulares por país / tipo                                        #
 # --------------------------------------------------------------------------- #
+# Ordenadas de mayor a menor longitud máxima. El resultado no depende del
+# orden: entre candidatos solapados gana el más largo (`_resolve_overlaps`).
 RAW_PATTERNS: Dict[str, str] = {
+    "NIT_SLV": r"\bSV[-\s]?\d{4}[-\s]?\d{6}[-\s]?\d{3}[-\s]?\d\b",
+    "CURP_MEX": r"\b[A-Z]{4}-?\d{6}-?[HM][A-Z]{5}[A-Z0-9]\b",
+    "RTN_HND": r"\bHN[-\s]?\d{4}[-\s]?\d{4}[-\s]?\d{5}\b",
+    "RUC_ECU": r"\bEC[-\s]?\d{10}[-\s]?\d{3}\b",
     "CI_NIC":  r"\b\d{3}[-\s]\d{6}[-\s]\d{4}[A-Z]?\b",
     "RUC_NIC": r"\b\d{3}[-\s]\d{6}[-\s]\d{4}[A-Z]?\b",
+    "CI_CUB": r"\bCUB[-\s]?\d{6}[-\s]?\d{5}\b",
+    "NIT_COL": r"\bCOL[-\s]?\d{8,10}-\d\b",
+    "RUC_PAN": r"\bP[-\s]?\d{1,4}[-\s]?\d{1,4}[-\s]?\d{1,4}\b",
+    "DPI_GTM": r"\b\d{4}[\s]\d{5}[\s]\d{4}\b",
+    "RFC_MEX": r"\b[A-ZÑñ&]{3,4}-?\d{6}-?[A-Z0-9]{3}\b",
+    "RNC_DOM": r"\bRD[-\s]?\d[-\s]?\d{2}[-\s]?\d{5}[-\s]?\d\b",
     "CPF_BRA": r"\b\d{3}[.\s-]\d{3}[.\s-]\d{3}[.\s-]\d{2}\b",
-    "DPI_GTM": r"\b\d{4}\s\d{5}\s\d{4}\b",
-    "CURP_MEX": r"\b[A-Z]{4}-?\d{6}-?[HM][A-Z]{5}[A-Z0-9]\b",
-    "RFC_MEX": r"\b[A-ZÑ&]{3,4}-?\d{6}-?[A-Z0-9]{3}\b",
-    "RIF_VEN": r"\b[JGVEP][- ]\d{8}[- ]\d\b",
-    "CI_BOL": r"\b\d{6,8}[-\s][A-Z]{2}\b",
-    "RUC_PRY": r"\b\d{6,8}[A-Z]?[-\s]\d\b",
+    "ID_HTI": r"\b\d{2}[-\s]\d{2}[-\s]\d{2}[-\s]\d{5}\b",
+    "CI_CRI": r"\bCR[-\s]?\d[-\s]?\d{4}[-\s]?\d{4}\b",
     "CUIT_ARG": r"\b\d{2}[.\s-]\d{8}[.\s-]\d\b",
+    "NIT_BOL": r"\bBO[-\s]?\d{6,8}[-\s]?\d\b",
+    "NIT_GTM": r"\bGT[-\s]?\d{6,8}[-\s]?\d\b",
+    "RUC_PER": r"\bPE[-\s]?(?:10|15|16|17|20)\d{8}\b",
+    "RIF_VEN": r"\b[JGVEP][- ]\d{8}[- ]\d\b",
     "CI_URU": r"\b\d{1,2}[.\s-]\d{3}[.\s-]\d{3}[.\s-]\d\b",
     "RUT_CHI": r"\b\d{1,2}[.\s-]\d{3}[.\s-]\d{3}[.\s-]?[\dkK]\b",
+    "CI_BOL": r"\b\d{6,8}[-\s][A-Z]{2}\b",
+    "RUC_PRY": r"\b\d{6,8}[A-Z]?[-\s]\d\b",
     "CI_VEN": r"\b[VvEe][- ]\d{6,8}\b",
     "PAS_ARG": r"\bAA[-\s]\d{7}\b",
     "PAS_CHI": r"\b[Cc]-\d{8}\b",
     "PAS_MEX": r"\bG-\d{8}\b",
-    "ID_HTI": r"\b\d{2}[-\s]\d{2}[-\s]\d{2}[-\s]\d{5}\b",
-    "CI_CRI": r"\bCR[-\s]?\d[-\s]?\d{4}[-\s]?\d{4}\b",
-    "CI_CUB": r"\bCUB[-\s]?\d{6}[-\s]?\d{5}\b",
-    "NIT_BOL": r"\bBO[-\s]?\d{6,8}[-\s]?\d\b",
-    "NIT_COL": r"\bCOL[-\s]?\d{8,10}-\d\b",
-    "NIT_GTM": r"\bGT[-\s]?\d{6,8}[-\s]?\d\b",
-    "NIT_SLV": r"\bSV[-\s]?\d{4}[-\s]?\d{6}[-\s]?\d{3}[-\s]?\d\b",
-    "RNC_DOM": r"\bRD[-\s]?\d[-\s]?\d{2}[-\s]?\d{5}[-\s]?\d\b",
-    "RTN_HND": r"\bHN[-\s]?\d{4}[-\s]?\d{4}[-\s]?\d{5}\b",
-    "RUC_ECU": r"\bEC[-\s]?\d{10}[-\s]?\d{3}\b",
-    "RUC_PAN": r"\bP[-\s]?\d{1,4}[-\s]?\d{1,4}[-\s]?\d{1,4}\b",
-    "RUC_PER": r"\bPE[-\s]?(10|15|16|17|20)\d{8}\b",
 }
 
-# Compilamos una sola vez para mayor velocidad (IGNORECASE en todos)
-PATTERNS: List[re.Pattern[str]] = [
-    re.compile(p, flags=re.IGNORECASE) for p in RAW_PATTERNS.values()
-]
+# \s es ASCII en todos los motores (re.ASCII, RE2, Hyperscan): se suman a
+# mano a cada clase de separadores los espacios duros frecuentes en texto
+# extraído de la web (U+00A0 y U+202F).
+_NBSP = "\u00a0\u202f"
+RAW_PATTERNS = {
+    name: pattern.replace(r"\s", r"\s" + _NBSP)
+    for name, pattern in RAW_PATTERNS.items()
+}
+
+# Los más frecuentes van primero en la alternancia: en un texto con ID se
+# prueban menos alternativas antes de encontrarlo. No cambia qué ID gana, eso
+# lo decide la resolución por longitud sobre los candidatos de cada patrón.
+HOT_PATTERNS: Tuple[str, ...] = ("RUT_CHI", "CPF_BRA", "CUIT_ARG")
+
+# Patrones formados solo por dígitos y separadores: no tienen letras, así
+# que IGNORECASE no les cambia nada y se compilan sin él.
+_DIGITS_ONLY: FrozenSet[str] = frozenset(
+    {"DPI_GTM", "CPF_BRA", "ID_HTI", "CUIT_ARG", "CI_URU"}
+)
+
+# Todo patrón con letras (prefijos de país, código de departamento, letra
+# de tipo o verificadora) acepta también minúsculas, como antes: un ID
+# escrito en minúscula ("12345678-lp", "j-12345678-9") no debe filtrarse.
+CASE_INSENSITIVE: FrozenSet[str] = frozenset(RAW_PATTERNS) - _DIGITS_ONLY
+
+# Fusionamos todo en una sola alternancia: un único recorrido basta para
+# saber si el texto tiene algún ID (la mayoría no tiene ninguno). IGNORECASE
+# va acotado con (?i:...) a los patrones que lo necesitan. Sin grupos de
+# captura, que solo encarecen cada coincidencia (basta con el span completo).
+# Todos empiezan con \b; lo sacamos de la alternancia para que el motor
+# descarte de inmediato las posiciones que no son borde de palabra.
+_WB = r"\b"
+
+
+def _alternative(name: str) -> str:
+    flags = "i" if name in CASE_INSENSITIVE else ""
+    return f"(?{flags}:{RAW_PATTERNS[name].removeprefix(_WB)})"
+
+
+MASTER_PATTERN: str = _WB + "(?:" + "|".join(
+    _alternative(name)
+    for name in HOT_PATTERNS + tuple(k for k in RAW_PATTERNS if k not in HOT_PATTERNS)
+) + ")"
+
+
+# Todos los patrones exigen al menos un dígito: textos sin dígitos no pueden
+# contener IDs y se devuelven sin escanear. Diez `in` (búsqueda en C) son
+# bastante más rápidos que re.search(r"\d") sobre el texto completo.
+_DIGITS = "0123456789"
+
+
+def _has_digit(text: str) -> bool:
+    return any(d in text for d in _DIGITS)
+
+
+def _compile_pattern(pattern: str):
+    """Compila con RE2 si está instalado; si no (o si lo rechaza) usa `re`.
+
+    En `re` se usa re.ASCII (clases sin tablas Unicode), igual que en RE2.
+    """
+    if re2 is not None:
+        try:
+            return re2.compile(pattern)
+        except re2.error:
+            pass
+    return re.compile(pattern, flags=re.ASCII)
+
+
+MASTER = _compile_pattern(MASTER_PATTERN)
+
+# Un patrón por ID, con su \b. La alternancia de MASTER solo devuelve la
+# coincidencia más a la izquierda; para elegir la más larga entre las que se
+# solapan, re / re2 buscan cada patrón por separado (como hace Hyperscan).
+PATTERN_SOURCES: List[str] = [_WB + _alternative(name) for name in RAW_PATTERNS]
+PATTERNS = [_compile_pattern(p) for p in PATTERN_SOURCES]
+
+
+def _compile_hyperscan():
+    """Base Hyperscan (modo bloque) con todos los patrones; None si no aplica."""
+    if hyperscan is None:
+        return None
+    base = hyperscan.HS_FLAG_SOM_LEFTMOST | hyperscan.HS_FLAG_UTF8
+    flags = [
+        base | hyperscan.HS_FLAG_CASELESS if name in CASE_INSENSITIVE else base
+        for name in RAW_PATTERNS
+    ]
+    db = hyperscan.Database(mode=hyperscan.HS_MODE_BLOCK)
+    try:
+        db.compile(
+            expressions=[p.encode("utf-8") for p in RAW_PATTERNS.values()],
+            ids=list(range(len(RAW_PATTERNS))),
+            elements=len(RAW_PATTERNS),
+            flags=flags,
+        )
+    except hyperscan.error:
+        return None
+    return db
+
+
+HS_DB = _compile_hyperscan()
 
 # --------------------------------------------------------------------------- #
 # Utilidades                                                                  #
 # --------------------------------------------------------------------------- #
 
 
-def replace_identifiers(text: str, label: str = "<ID>") -> str:
-    """Reemplaza IDs sin permitir solapamientos (evita <ID<ID>)."""
-    # 1. Recolectar todas las coincidencias (patrón, inicio, fin)
+def _on_hs_match(pat_id: int, start: int, end: int, _flags: int, hits) -> None:
+    hits.append((pat_id, start, end))
+
+
+def _per_pattern_matches(
+    hits: List[Tuple[int, int, int]]
+) -> List[Tuple[int, int]]:
+    """Reduce los reportes de Hyperscan a lo que daría `finditer` por patrón.
+
+    Hyperscan reporta cada fin posible (p. ej. "P 9 12" dentro de
+    "P 9 1234 1"); por patrón se toma la más a la izquierda, la más larga,
+    y se sigue tras su fin, sin solapes dentro del mismo patrón.
+    """
+    if len(hits) == 1:
+        return [hits[0][1:]]
+    hits.sort(key=lambda h: (h[0], h[1], -h[2]))
     spans: List[Tuple[int, int]] = []
-    for pat in PATTERNS:
-        spans.extend(m.span() for m in pat.finditer(text))
+    current, last_end = -1, 0
+    for pat_id, start, end in hits:
+        if pat_id != current:
+            current, last_end = pat_id, 0
+        if start >= last_end:
+            spans.append((start, end))
+            last_end = end
+    return spans
 
-    if not spans:
-        return text
 
-    # 2. Ordenar: primero los más largos, luego por inicio
+def _byte_to_char_spans(
+    data: bytes, spans: List[Tuple[int, int]]
+) -> List[Tuple[int, int]]:
+    """Convierte offsets en bytes UTF-8 a offsets en caracteres."""
+    to_char: Dict[int, int] = {}
+    prev = pos = 0
+    for b in sorted({b for span in spans for b in span}):
+        pos += len(data[prev:b].decode("utf-8"))
+        to_char[b] = pos
+        prev = b
+    return [(to_char[s], to_char[e]) for s, e in spans]
+
+
+def _hyperscan_spans(text: str) -> List[Tuple[int, int]]:
+    """(inicio, fin) en caracteres de cada coincidencia de Hyperscan.
+
+    Como con `_regex_spans`, los spans de patrones distintos pueden
+    solaparse. Requiere HS_DB.
+    """
+    data = text.encode("utf-8")
+    hits: List[Tuple[int, int, int]] = []
+    HS_DB.scan(data, match_event_handler=_on_hs_match, context=hits)
+    spans = _per_pattern_matches(hits)
+    if spans and len(data) != len(text):  # texto no ASCII
+        spans = _byte_to_char_spans(data, spans)
+    return spans
+
+
+def _regex_spans(text: str) -> List[Tuple[int, int]]:
+    """(inicio, fin) de las coincidencias de cada patrón con re / re2.
+
+    Igual que con Hyperscan, los spans de patrones distintos pueden solaparse.
+    """
+    # MASTER solo dice si hay algún ID: la mayoría de los textos no tiene
+    # ninguno y se resuelven con un único recorrido
+    first = MASTER.search(text)
+    if first is None:
+        return []
+    # Ningún patrón coincide antes que la alternancia completa. Con re2 no se
+    # usa: su envoltorio convierte `pos` a bytes en cada llamada y eso cuesta
+    # más que recorrer el prefijo
+    pos = first.start() if isinstance(MASTER, re.Pattern) else 0
+    return [m.span() for pat in PATTERNS for m in pat.finditer(text, pos)]
+
+
+def _resolve_overlaps(spans: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Spans disjuntos ordenados por inicio; gana el más largo y, a igual
+    largo, el que empieza antes. No se deja un ID a medio tapar porque un
+    candidato más corto empezó a su izquierda."""
+    # Ordenar: primero los más largos, luego por inicio
     spans.sort(key=lambda s: (-(s[1] - s[0]), s[0]))
 
-    chars = list(text)
-    occupied = [False] * len(chars)
+    # Intervalos aceptados, disjuntos y ordenados por inicio
+    starts: List[int] = []
+    ends: List[int] = []
 
     for start, end in spans:
-        # ¿Algún carácter de este rango ya fue reemplazado?
-        if any(occupied[start:end]):
+        # ¿Solapa con el intervalo aceptado anterior o con el siguiente?
+        i = bisect_right(starts, start)
+        if (i and ends[i - 1] > start) or (i < len(starts) and starts[i] < end):
             continue  # solapa → saltar
 
-        repl = list(label.ljust(end - start))
-        chars[start:end] = repl
-        for i in range(start, end):
-            occupied[i] = True
+        starts.insert(i, start)
+        ends.insert(i, end)
+    return list(zip(starts, ends))
+
 
-    return "".join(chars)
+def replace_identifiers(text: str, label: str = "<ID>", pad: bool = True) -> str:
+    """Reemplaza IDs sin permitir solapamientos (evita <ID<ID>).
+
+    Con `pad=False` la etiqueta no se rellena a la longitud del ID.
+    """
+    if not _has_digit(text):
+        return text
+
+    # 1. Coincidencias (inicio, fin) de todos los patrones, solapadas
+    spans = _hyperscan_spans(text) if HS_DB is not None else _regex_spans(text)
+
+    if not spans:
+        return text
+
+    # 2. Quedarse con spans disjuntos, primero los más largos (con un único
+    #    candidato no hay nada que resolver, caso más común)
+    accepted = spans if len(spans) == 1 else _resolve_overlaps(spans)
+
+    # 3. Unir los tramos intactos con las etiquetas (rellenadas a la longitud
+    #    original) sin pasar el texto a una lista de caracteres
+    parts: List[str] = []
+    last = 0
+    for start, end in accepted:
+        parts.append(text[last:start])
+        parts.append(label.ljust(end - start) if pad else label)
+        last = end
+    parts.append(text[last:])
+    return "".join(parts)
+
+
+def _replace_batch(examples: Dict[str, Any], *, col: str) -> Dict[str, Any]:
+    """Aplica `replace_identifiers` a un lote de `datasets.map(batched=True)`."""
+    examples[col] = [replace_identifiers(t) for t in examples[col]]
+    return examples
+
+
+def _replace_batch_arrow(table: pa.Table, *, col: str) -> pa.Table:
+    """Reemplaza IDs sobre la columna Arrow; solo pasan por Python las filas
+    que tienen algún ID.
+
+    La etiqueta no se rellena, por lo que no conserva la longitud del texto.
+    """
+    # La búsqueda es vectorizada; el reemplazo no, porque la alternancia de
+    # Arrow (RE2) toma el candidato más a la izquierda y no el más largo
+    column = table[col].combine_chunks()
+    hit = pc.fill_null(pc.match_substring_regex(column, pattern=MASTER_PATTERN), False)
+    rows = pc.filter(column, hit).to_pylist()
+    if rows:
+        replaced = [replace_identifiers(t, pad=False) for t in rows]
+        column = pc.replace_with_mask(column, hit, pa.array(replaced, column.type))
+    return table.set_column(table.column_names.index(col), col, column)
 
 
 def build_demo_dataset(col: str = "text") -> Dataset:
@@ -169,6 +403,26 @@ def build_demo_dataset(col: str = "text") -> Dataset:
     return Dataset.from_dict(data)
 
 
+# --------------------------------------------------------------------------- #
+# Microbenchmark                                                              #
+# --------------------------------------------------------------------------- #
+
+
+def run_benchmark(repeat: int) -> float:
+    """Filas/s de `replace_identifiers` sobre el demo repetido `repeat` veces."""
+    corpus = list(build_demo_dataset()["text"]) * repeat
+    engine = "hyperscan" if HS_DB is not None else type(MASTER).__module__
+
+    replace_identifiers(corpus[0])  # calentamiento
+    t0 = time.perf_counter()
+    for text in corpus:
+        replace_identifiers(text)
+    rate = len(corpus) / (time.perf_counter() - t0)
+
+    print(f"[BENCH] {len(corpus):,} filas · motor {engine} · {rate:,.0f} filas/s")
+    return rate
+
+
 # --------------------------------------------------------------------------- #
 # Main                                                                        #
 # --------------------------------------------------------------------------- #
@@ -179,14 +433,27 @@ def main() -> None:
         description="Anonimiza identificadores personales con la etiqueta <ID>."
     )
     parser.add_argument("--input_path", help="Ruta al dataset Hugging Face")
-    parser.add_argument("--output_path", required=True,
+    parser.add_argument("--output_path",
                         help="Ruta para guardar el dataset anonimizado")
     parser.add_argument("--column", default="text",
                         help="Nombre de la columna de texto (default: 'text')")
+    parser.add_argument("--batch_size", type=int, default=1000)
+    parser.add_argument("--num_proc", type=int, default=os.cpu_count())
+    parser.add_argument("--no_pad", action="store_true",
+                        help="Reemplazo vectorizado en Arrow; no conserva "
+                             "la longitud del texto")
     parser.add_argument("--demo", action="store_true",
                         help="Usa un dataset de demostración")
+    parser.add_argument("--bench", type=int, metavar="N",
+                        help="Solo mide filas/s sobre el demo repetido N veces")
     args = parser.parse_args()
 
+    if args.bench:
+        run_benchmark(args.bench)
+        return
+    if not args.output_path:
+        raise ValueError("Debe especificar --output_path")
+
     # --------------------------------------------------------------------- #
     # Cargar dataset                                                         #
     # --------------------------------------------------------------------- #
@@ -206,10 +473,16 @@ def main() -> None:
     # Anonimizar                                                             #
     # --------------------------------------------------------------------- #
     print("[INFO] Anonimizando identificadores…")
+    if args.no_pad:
+        ds = ds.with_format("arrow")
     ds_anonymized = ds.map(
-        lambda ex: {args.column: replace_identifiers(ex[args.column])},
+        _replace_batch_arrow if args.no_pad else _replace_batch,
+        batched=True,
+        batch_size=args.batch_size,
+        num_proc=args.num_proc,
         desc="🔐 Reemplazando",
-    )
+        fn_kwargs=dict(col=args.column),
+    ).with_format(None)
 
     # --------------------------------------------------------------------- #
     # Guardar                                                               #
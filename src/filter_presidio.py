@@ -2,17 +2,42 @@
 Anonymizador masivo con Presidio + HuggingFace Datasets
 ------------------------------------------------------------------
 • sin copias intermedias     • paralelo con num_proc
-• conserva orden y longitud  • inicialización perezosa de Presidio
+• conserva orden y longitud  • Presidio precargado antes del fork
 """
 
 import argparse
 import os
+import re
+import threading
 import time
-from typing import Any, Dict, List
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
 
-from datasets import Dataset, load_from_disk
-from presidio_analyzer import AnalyzerEngine
-from presidio_anonymizer import AnonymizerEngine
+# Un hilo por worker: spaCy y las librerías BLAS/OpenMP leen estas
+# variables al importarse, así que se fijan antes de importar datasets y
+# Presidio.
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+os.environ["OMP_NUM_THREADS"] = "1"
+os.environ["MKL_NUM_THREADS"] = "1"
+
+from datasets import Dataset, load_from_disk  # noqa: E402
+from presidio_analyzer import (  # noqa: E402
+    AnalyzerEngine,
+    BatchAnalyzerEngine,
+    RecognizerResult,
+)
+from presidio_analyzer.nlp_engine import NlpEngineProvider  # noqa: E402
+from presidio_anonymizer import AnonymizerEngine  # noqa: E402
+
+try:  # núcleos físicos (opcional): pip install psutil
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def _physical_cores() -> int:
+    """Núcleos físicos; sin psutil, se asume la mitad de los lógicos (HT)."""
+    cores = psutil.cpu_count(logical=False) if psutil is not None else None
+    return cores or max(1, (os.cpu_count() or 1) // 2)
 
 
 # -------------------------------------------------------------------
@@ -36,13 +61,18 @@ def parse_args():
         help="Nombre de la columna de texto a anonimizar",
     )
     parser.add_argument("--batch_size", type=int, default=64)
-    parser.add_argument("--num_proc", type=int, default=os.cpu_count() // 2)
+    parser.add_argument("--num_proc", type=int, default=_physical_cores())
     parser.add_argument("--max_text_len", type=int, default=100_000)
     parser.add_argument(
         "--entities",
         default="EMAIL_ADDRESS,IP_ADDRESS,PHONE_NUMBER,CREDIT_CARD",
     )
     parser.add_argument("--language", default="en")
+    parser.add_argument(
+        "--spacy_model",
+        default="en_core_web_lg",
+        help="Modelo spaCy (nombre o ruta) que usa Presidio",
+    )
     parser.add_argument(
         "--demo",
         action="store_true",
@@ -52,51 +82,140 @@ def parse_args():
 
 
 # -------------------------------------------------------------------
-# Motores de análisis y anonimización (lazy init por proceso)
+# Motores de análisis y anonimización (caché por hilo)
 # -------------------------------------------------------------------
-_analyzer: AnalyzerEngine | None = None
-_anonymizer: AnonymizerEngine | None = None
+# AnalyzerEngine no es thread-safe: cada hilo tiene su propia instancia.
+# Se precargan en el proceso principal para que los workers de
+# datasets.map (fork) hereden el modelo spaCy ya cargado.
+_tls = threading.local()
 
 
-def _ensure_engines():
-    """Inicializa motores en cada proceso (solo una vez por worker)."""
-    global _analyzer, _anonymizer
-    if _analyzer is None:
-        _analyzer = AnalyzerEngine()
-        _anonymizer = AnonymizerEngine()
+def ensure_engines(
+    language: str, spacy_model: str
+) -> Tuple[BatchAnalyzerEngine, AnonymizerEngine]:
+    """Motores del hilo actual para (language, spacy_model), creados una vez."""
+    engines = getattr(_tls, "engines", None)
+    if engines is None:
+        engines = _tls.engines = {}
+    key = (language, spacy_model)
+    if key not in engines:
+        nlp_engine = NlpEngineProvider(
+            nlp_configuration={
+                "nlp_engine_name": "spacy",
+                "models": [{"lang_code": language, "model_name": spacy_model}],
+            }
+        ).create_engine()
+        # Presidio no usa el árbol de dependencias
+        for nlp in nlp_engine.nlp.values():
+            if "parser" in nlp.pipe_names:
+                nlp.disable_pipe("parser")
+        # BatchAnalyzerEngine pasa el lote completo por nlp.pipe de spaCy
+        analyzer = BatchAnalyzerEngine(
+            analyzer_engine=AnalyzerEngine(
+                nlp_engine=nlp_engine, supported_languages=[language]
+            )
+        )
+        engines[key] = (analyzer, AnonymizerEngine())
+    return engines[key]
 
 
 # -------------------------------------------------------------------
-# Función que anonimiza un batch de textos
+# Pre-filtro barato: descarta textos que no pueden contener PII
 # -------------------------------------------------------------------
-def _anonymize_batch(
-    examples: Dict[str, Any],
+# Condición necesaria para que el recognizer de Presidio encuentre algo
+PII_HINTS: Dict[str, str] = {
+    "EMAIL_ADDRESS": r"@",
+    "IP_ADDRESS": r"\d\.\d|:[0-9A-Fa-f]*:",
+    "PHONE_NUMBER": r"\d",
+    "CREDIT_CARD": r"\d{4}",
+}
+
+
+def build_pii_prefilter(entities: List[str]) -> Optional[re.Pattern[str]]:
+    """Regex combinada para `entities`; None si alguna no tiene pista barata."""
+    if not entities or any(e not in PII_HINTS for e in entities):
+        return None
+    return re.compile("|".join(PII_HINTS[e] for e in entities))
+
+
+# -------------------------------------------------------------------
+# Detección: sin spaCy cuando solo se piden entidades de patrones
+# -------------------------------------------------------------------
+# Presidio las detecta con regex + validadores (Luhn, phonenumbers, …); el
+# pipeline NLP solo aporta lemas para el realce de score por contexto.
+PATTERN_ONLY: FrozenSet[str] = frozenset({
+    "EMAIL_ADDRESS",
+    "IP_ADDRESS",
+    "PHONE_NUMBER",
+    "CREDIT_CARD",
+    "CRYPTO",
+    "IBAN_CODE",
+    "URL",
+})
+
+
+def analyze_texts(
+    analyzer: BatchAnalyzerEngine,
+    texts: List[str],
+    *,
+    language: str,
+    entities: List[str],
+) -> List[List[RecognizerResult]]:
+    """Resultados de Presidio por texto, en el mismo orden que `texts`."""
+    if entities and all(e in PATTERN_ONLY for e in entities):
+        # Artefactos NLP vacíos: AnalyzerEngine no ejecuta spaCy y corre
+        # directamente los recognizers de patrones
+        engine = analyzer.analyzer_engine
+        no_nlp = engine.nlp_engine.process_text("", language)
+        return [
+            engine.analyze(
+                t, language=language, entities=entities, nlp_artifacts=no_nlp
+            )
+            for t in texts
+        ]
+
+    # Una sola pasada de spaCy para todo el lote
+    return list(analyzer.analyze_iterator(
+        texts,
+        language=language,
+        batch_size=len(texts),
+        entities=entities,
+    ))
+
+
+# -------------------------------------------------------------------
+# Anonimización de una lista de textos (también la usa full_anon.py)
+# -------------------------------------------------------------------
+def anonymize_texts(
+    texts: List[Any],
     *,
-    col: str,
     entities: List[str],
     language: str,
+    spacy_model: str,
     max_len: int,
-):
-    """Aplica anonimización en lote, preservando orden original."""
-    _ensure_engines()
+    prefilter: Optional[re.Pattern[str]] = None,
+) -> List[Any]:
+    """Enmascara la PII de `texts`, preservando orden y largo de la lista.
+
+    Quedan intactos los valores que no son str, los más largos que `max_len`
+    y los que no pasan el pre-filtro.
+    """
+    analyzer, anonymizer = ensure_engines(language, spacy_model)
 
-    texts: List[str] = examples[col]
-    valid_mask = [isinstance(t, str) and len(t) <= max_len for t in texts]
+    # Solo van a Presidio los textos válidos que pasan el pre-filtro
+    valid_mask = [
+        isinstance(t, str)
+        and len(t) <= max_len
+        and (prefilter is None or prefilter.search(t) is not None)
+        for t in texts
+    ]
     valid_texts = [t for t, ok in zip(texts, valid_mask) if ok]
 
     # Detectar entidades
     if valid_texts:
-        if hasattr(_analyzer, "analyze_batch"):  # versiones modernas
-            results = _analyzer.analyze_batch(
-                text=valid_texts,
-                language=language,
-                entities=entities,
-            )
-        else:  # fallback a versiones antiguas
-            results = [
-                _analyzer.analyze(text=t, language=language, entities=entities)
-                for t in valid_texts
-            ]
+        results = analyze_texts(
+            analyzer, valid_texts, language=language, entities=entities
+        )
     else:
         results = []
 
@@ -107,12 +226,21 @@ def _anonymize_batch(
             res = results[idx]
             idx += 1
             new_texts.append(
-                _anonymizer.anonymize(text=t, analyzer_results=res).text if res else t
+                anonymizer.anonymize(text=t, analyzer_results=res).text if res else t
             )
         else:
             new_texts.append(t)
+    return new_texts
+
 
-    examples[col] = new_texts
+# -------------------------------------------------------------------
+# Función que anonimiza un batch de textos
+# -------------------------------------------------------------------
+def _anonymize_batch(
+    examples: Dict[str, Any], *, col: str, **kwargs: Any
+) -> Dict[str, Any]:
+    """Aplica anonimización en lote, preservando orden original."""
+    examples[col] = anonymize_texts(examples[col], **kwargs)
     return examples
 
 
@@ -138,12 +266,12 @@ def build_demo_ds(col="texto") -> Dataset:
 def main():
     args = parse_args()
 
-    os.environ["TOKENIZERS_PARALLELISM"] = "false"
-    os.environ["OMP_NUM_THREADS"] = "1"
-
     entities = [e.strip() for e in args.entities.split(",") if e.strip()]
     t0 = time.perf_counter()
 
+    # Precargar motores: los workers (fork) heredan el modelo ya cargado
+    ensure_engines(args.language, args.spacy_model)
+
     # 1. Cargar dataset
     ds = build_demo_ds(args.text_column) if args.demo else load_from_disk(
         args.input_path
@@ -161,7 +289,9 @@ def main():
             col=args.text_column,
             entities=entities,
             language=args.language,
+            spacy_model=args.spacy_model,
             max_len=args.max_text_len,
+            prefilter=build_pii_prefilter(entities),
         ),
         load_from_cache_file=False,
         writer_batch_size=args.batch_size,
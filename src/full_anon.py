@@ -2,7 +2,7 @@
 Anonimización completa (Presidio + IDs) para Hugging Face Datasets
 -----------------------------------------------------------------
 • Paso 1 – Presidio: EMAIL_ADDRESS, PHONE_NUMBER, … (configurable)
-• Paso 2 – Regex: RUT, CURP, CPF, CUIT, etc.  →  <ID>
+• Paso 2 – Regex: RUT, CURP, CPF, CUIT, etc.  →  <ID>  (de filter_ID.py)
 • Paralelizable con --num_proc, sin copias intermedias
 """
 
@@ -12,94 +12,23 @@ import argparse
 import os
 import re
 import time
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional
 
-from datasets import Dataset, load_from_disk
-from presidio_analyzer import AnalyzerEngine
-from presidio_anonymizer import AnonymizerEngine
+# Un hilo por worker. Va antes de los imports de datasets / Presidio, que
+# cargan spaCy y las librerías BLAS/OpenMP, y estas leen las variables al
+# importarse.
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+os.environ["OMP_NUM_THREADS"] = "1"
+os.environ["MKL_NUM_THREADS"] = "1"
 
-# --------------------------------------------------------------------------- #
-# Patrones de identificadores (compilados una sola vez)                       #
-# --------------------------------------------------------------------------- #
-RAW_PATTERNS: Dict[str, str] = {
-    "CI_NIC":  r"\b\d{3}[-\s]\d{6}[-\s]\d{4}[A-Z]?\b",
-    "RUC_NIC": r"\b\d{3}[-\s]\d{6}[-\s]\d{4}[A-Z]?\b",
-    "CPF_BRA": r"\b\d{3}[.\s-]\d{3}[.\s-]\d{3}[.\s-]\d{2}\b",
-    "DPI_GTM": r"\b\d{4}\s\d{5}\s\d{4}\b",
-    "CURP_MEX": r"\b[A-Z]{4}-?\d{6}-?[HM][A-Z]{5}[A-Z0-9]\b",
-    "RFC_MEX": r"\b[A-ZÑ&]{3,4}-?\d{6}-?[A-Z0-9]{3}\b",
-    "RIF_VEN": r"\b[JGVEP][- ]\d{8}[- ]\d\b",
-    "CI_BOL": r"\b\d{6,8}[-\s][A-Z]{2}\b",
-    "RUC_PRY": r"\b\d{6,8}[A-Z]?[-\s]\d\b",
-    "CUIT_ARG": r"\b\d{2}[.\s-]\d{8}[.\s-]\d\b",
-    "CI_URU": r"\b\d{1,2}[.\s-]\d{3}[.\s-]\d{3}[.\s-]\d\b",
-    "RUT_CHI": r"\b\d{1,2}[.\s-]\d{3}[.\s-]\d{3}[.\s-]?[\dkK]\b",
-    "CI_VEN": r"\b[VvEe][- ]\d{6,8}\b",
-    "PAS_ARG": r"\bAA[-\s]\d{7}\b",
-    "PAS_CHI": r"\b[Cc]-\d{8}\b",
-    "PAS_MEX": r"\bG-\d{8}\b",
-    "ID_HTI": r"\b\d{2}[-\s]\d{2}[-\s]\d{2}[-\s]\d{5}\b",
-    "CI_CRI": r"\bCR[-\s]?\d[-\s]?\d{4}[-\s]?\d{4}\b",
-    "CI_CUB": r"\bCUB[-\s]?\d{6}[-\s]?\d{5}\b",
-    "NIT_BOL": r"\bBO[-\s]?\d{6,8}[-\s]?\d\b",
-    "NIT_COL": r"\bCOL[-\s]?\d{8,10}-\d\b",
-    "NIT_GTM": r"\bGT[-\s]?\d{6,8}[-\s]?\d\b",
-    "NIT_SLV": r"\bSV[-\s]?\d{4}[-\s]?\d{6}[-\s]?\d{3}[-\s]?\d\b",
-    "RNC_DOM": r"\bRD[-\s]?\d[-\s]?\d{2}[-\s]?\d{5}[-\s]?\d\b",
-    "RTN_HND": r"\bHN[-\s]?\d{4}[-\s]?\d{4}[-\s]?\d{5}\b",
-    "RUC_ECU": r"\bEC[-\s]?\d{10}[-\s]?\d{3}\b",
-    "RUC_PAN": r"\bP[-\s]?\d{1,4}[-\s]?\d{1,4}[-\s]?\d{1,4}\b",
-    "RUC_PER": r"\bPE[-\s]?(10|15|16|17|20)\d{8}\b",
-}
-
-PATTERNS: List[re.Pattern[str]] = [
-    re.compile(p, re.IGNORECASE) for p in RAW_PATTERNS.values()
-    ]
-
-
-def replace_identifiers(text: str, label: str = "<ID>") -> str:
-    """Reemplaza IDs sin permitir solapamientos (evita <ID<ID>)."""
-    # 1. Recolectar todas las coincidencias (patrón, inicio, fin)
-    spans: List[Tuple[int, int]] = []
-    for pat in PATTERNS:
-        spans.extend(m.span() for m in pat.finditer(text))
-
-    if not spans:
-        return text
-
-    # 2. Ordenar: primero los más largos, luego por inicio
-    spans.sort(key=lambda s: (-(s[1] - s[0]), s[0]))
-
-    chars = list(text)
-    occupied = [False] * len(chars)
-
-    for start, end in spans:
-        # ¿Algún carácter de este rango ya fue reemplazado?
-        if any(occupied[start:end]):
-            continue  # solapa → saltar
-
-        repl = list(label.ljust(end - start))
-        chars[start:end] = repl
-        for i in range(start, end):
-            occupied[i] = True
-
-    return "".join(chars)
-
-
-# --------------------------------------------------------------------------- #
-# Presidio (lazy init por worker)                                             #
-# --------------------------------------------------------------------------- #
-
-_ANALYZER: AnalyzerEngine | None = None
-_ANONYMIZER: AnonymizerEngine | None = None
-
-
-def ensure_presidio() -> Tuple[AnalyzerEngine, AnonymizerEngine]:
-    global _ANALYZER, _ANONYMIZER
-    if _ANALYZER is None:
-        _ANALYZER = AnalyzerEngine()
-        _ANONYMIZER = AnonymizerEngine()
-    return _ANALYZER, _ANONYMIZER
+from datasets import Dataset, load_from_disk  # noqa: E402
+from filter_ID import replace_identifiers  # noqa: E402  patrones y reemplazo de IDs
+# Presidio (motores, pre-filtro y enmascarado) es el mismo de filter_presidio
+from filter_presidio import (  # noqa: E402
+    anonymize_texts,
+    build_pii_prefilter,
+    ensure_engines,
+)
 
 
 # --------------------------------------------------------------------------- #
@@ -143,44 +72,69 @@ def process_batch(
     col: str,
     entities: List[str],
     language: str,
+    spacy_model: str,
     max_len: int,
+    prefilter: Optional[re.Pattern[str]] = None,
 ) -> Dict[str, Any]:
-    analyzer, anonymizer = ensure_presidio()
-    texts = examples[col]
-    new_texts: List[str] = []
+    # Textos repetidos dentro del lote se procesan una sola vez
+    first_seen: Dict[Any, int] = {}
+    inverse = [first_seen.setdefault(t, len(first_seen)) for t in examples[col]]
+    texts = list(first_seen)
 
     # ------------------------------------------------------------ Presidio --
-    valid_mask = [isinstance(t, str) and len(t) <= max_len for t in texts]
-    valid_texts = [t for t, ok in zip(texts, valid_mask) if ok]
-
-    if valid_texts:
-        if hasattr(analyzer, "analyze_batch"):
-            detections = analyzer.analyze_batch(
-                text=valid_texts, language=language, entities=entities
-            )
-        else:
-            detections = [analyzer.analyze(t, language=language, entities=entities)
-                          for t in valid_texts]
-    else:
-        detections = []
-
-    idx = 0
-    for t, ok in zip(texts, valid_mask):
-        if ok:
-            pii_clean = anonymizer.anonymize(text=t,
-                                             analyzer_results=detections[idx]).text
-            idx += 1
-        else:
-            pii_clean = t  # demasiado largo → no procesar PII
-
-        # --------------------------------------------------- Reemplazo IDs --
-        final_text = replace_identifiers(pii_clean)
-        new_texts.append(final_text)
-
-    examples[col] = new_texts
+    # Los textos demasiado largos o sin pistas de PII no pasan por Presidio;
+    # el reemplazo de IDs se aplica igual a todas las filas
+    new_texts = anonymize_texts(
+        texts,
+        entities=entities,
+        language=language,
+        spacy_model=spacy_model,
+        max_len=max_len,
+        prefilter=prefilter,
+    )
+
+    # ------------------------------------------------------- Reemplazo IDs --
+    # Misma pasada fusionada de filter_ID sobre todo el lote
+    new_texts = [replace_identifiers(t) for t in new_texts]
+
+    # Volver a expandir al orden y largo originales del lote
+    examples[col] = [new_texts[i] for i in inverse]
     return examples
 
 
+# Bajo este tiempo estimado en serie no compensa lanzar workers (fork +
+# carga de spaCy en cada uno); por encima, cada worker debe recibir al menos
+# este trabajo.
+_AUTO_SERIAL_SECONDS = 10.0
+
+
+def estimate_num_proc(
+    ds: Dataset, *, batch_size: int, max_proc: int, **fn_kwargs: Any
+) -> Optional[int]:
+    """Elige num_proc midiendo un lote de calentamiento en serie.
+
+    Devuelve None (en `datasets.map` significa procesar en serie, sin
+    procesos) cuando el dataset completo tardaría poco en un solo proceso.
+    """
+    # La carga del modelo no cuenta en la medición
+    ensure_engines(fn_kwargs["language"], fn_kwargs["spacy_model"])
+    n = min(batch_size, ds.num_rows)
+    if n == 0:
+        return None
+
+    t0 = time.perf_counter()
+    process_batch(ds[:n], **fn_kwargs)
+    per_row = (time.perf_counter() - t0) / n
+
+    serial_seconds = per_row * ds.num_rows
+    n_batches = -(-ds.num_rows // batch_size)
+    num_proc = min(max_proc, n_batches, int(serial_seconds // _AUTO_SERIAL_SECONDS))
+    result = num_proc if num_proc > 1 else None
+    print(f"[INFO] Calentamiento: {1 / per_row:,.0f} filas/s en serie "
+          f"→ num_proc={result}")
+    return result
+
+
 # --------------------------------------------------------------------------- #
 # Main                                                                         #
 # --------------------------------------------------------------------------- #
@@ -194,18 +148,25 @@ def main() -> None:
     parser.add_argument("--column", default="texto",
                         help="Columna de texto (default: 'texto')")
     parser.add_argument("--batch_size", type=int, default=64)
-    parser.add_argument("--num_proc", type=int, default=os.cpu_count() // 2)
+    parser.add_argument("--num_proc", type=int, default=os.cpu_count() // 2,
+                        help="Procesos de datasets.map (0 = en serie)")
+    parser.add_argument("--auto_num_proc", action="store_true",
+                        help="Estimar num_proc con un lote de calentamiento "
+                             "(--num_proc pasa a ser el máximo)")
+    parser.add_argument("--writer_batch_size", type=int, default=4096,
+                        help="Filas por escritura Arrow (aparte de --batch_size)")
+    parser.add_argument("--in_memory", action="store_true",
+                        help="Dataset y resultado en RAM, sin archivos caché")
     parser.add_argument("--max_text_len", type=int, default=100_000)
     parser.add_argument("--entities", 
                         default="EMAIL_ADDRESS,IP_ADDRESS,PHONE_NUMBER,CREDIT_CARD",
                         help="Entidades Presidio separadas por coma")
     parser.add_argument("--language", default="en")
+    parser.add_argument("--spacy_model", default="en_core_web_lg",
+                        help="Modelo spaCy (nombre o ruta) que usa Presidio")
     parser.add_argument("--demo", action="store_true", help="Dataset de demostración")
     args = parser.parse_args()
 
-    os.environ["TOKENIZERS_PARALLELISM"] = "false"
-    os.environ["OMP_NUM_THREADS"] = "1"
-
     entities = [e.strip() for e in args.entities.split(",") if e.strip()]
     t0 = time.perf_counter()
 
@@ -219,7 +180,7 @@ def main() -> None:
         if not args.input_path:
             raise ValueError("Debe indicar --input_path o usar --demo")
         print("[INFO] Cargando dataset…")
-        ds = load_from_disk(args.input_path)
+        ds = load_from_disk(args.input_path, keep_in_memory=args.in_memory)
 
     if args.column not in ds.column_names:
         raise ValueError(f"La columna '{args.column}' no existe en el dataset.")
@@ -229,21 +190,36 @@ def main() -> None:
     # --------------------------------------------------------------------- #
     # Procesar en paralelo                                                   #
     # --------------------------------------------------------------------- #
+    fn_kwargs = dict(
+        col=args.column,
+        entities=entities,
+        language=args.language,
+        spacy_model=args.spacy_model,
+        max_len=args.max_text_len,
+        # Salta spaCy en filas que no pueden contener las entidades pedidas
+        prefilter=build_pii_prefilter(entities),
+    )
+    # Precargar motores: los workers (fork) heredan el modelo ya cargado
+    ensure_engines(args.language, args.spacy_model)
+
+    # num_proc=None → datasets.map corre en el proceso actual
+    num_proc = args.num_proc if args.num_proc > 0 else None
+    if args.auto_num_proc:
+        num_proc = estimate_num_proc(
+            ds, batch_size=args.batch_size, max_proc=max(1, args.num_proc), **fn_kwargs
+        )
+
     ds_final = ds.map(
         process_batch,
         batched=True,
         batch_size=args.batch_size,
-        num_proc=args.num_proc,
+        num_proc=num_proc,
         desc="🔐 Presidio + IDs",
-        fn_kwargs=dict(
-            col=args.column,
-            entities=entities,
-            language=args.language,
-            max_len=args.max_text_len,
-        ),
+        fn_kwargs=fn_kwargs,
         load_from_cache_file=False,
-        writer_batch_size=args.batch_size,
-        keep_in_memory=False,
+        # Menos vaciados del archivo caché que con un flush por lote
+        writer_batch_size=args.writer_batch_size,
+        keep_in_memory=args.in_memory,
     )
 
     # --------------------------------------------------------------------- #
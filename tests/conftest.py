@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Los scripts viven en src/ y se importan como módulos sueltos
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
@@ -0,0 +1,176 @@
+"""
+Regresiones del reemplazo de IDs en los tres motores (Hyperscan, RE2, re).
+
+Fija la salida del dataset de demostración y la equivalencia entre los
+candidatos por patrón de re / re2 y los de Hyperscan, ambos resueltos
+primero por longitud como el filtro original.
+"""
+
+import random
+import re
+
+import pyarrow as pa
+import pytest
+
+import filter_ID
+
+ENGINES = ["hyperscan", "re2", "re"]
+
+
+@pytest.fixture(params=ENGINES)
+def engine(request, monkeypatch):
+    """Fuerza `replace_identifiers` a usar un motor concreto."""
+    name = request.param
+    if name == "hyperscan":
+        if filter_ID.HS_DB is None:
+            pytest.skip("hyperscan no disponible")
+    elif name == "re2":
+        if filter_ID.re2 is None:
+            pytest.skip("google-re2 no disponible")
+        monkeypatch.setattr(filter_ID, "HS_DB", None)
+        _use_compiler(monkeypatch, filter_ID.re2.compile)
+    else:
+        monkeypatch.setattr(filter_ID, "HS_DB", None)
+        _use_compiler(monkeypatch, lambda p: re.compile(p, flags=re.ASCII))
+    return name
+
+
+def _use_compiler(monkeypatch, compile_):
+    monkeypatch.setattr(filter_ID, "MASTER", compile_(filter_ID.MASTER_PATTERN))
+    monkeypatch.setattr(
+        filter_ID, "PATTERNS", [compile_(p) for p in filter_ID.PATTERN_SOURCES]
+    )
+
+
+# --------------------------------------------------------------------------- #
+# Dataset de demostración                                                     #
+# --------------------------------------------------------------------------- #
+DEMO_MASKED = {
+    "Mi RUT es 12.345.678-9": "Mi RUT es <ID>        ",
+    "RFC: GOM8405121A1": "RFC: <ID>        ",
+    "Número cubano: CUB-123456-54321": "Número cubano: <ID>            ",
+    "DPI guatemalteco: 1234 56789 1234": "DPI guatemalteco: <ID>           ",
+    "ID Haití: 01-02-03-12345": "ID Haití: <ID>          ",
+    "CI Bolivia: 12345678-LP": "CI Bolivia: <ID>       ",
+    "CUIT: 20-12345678-1": "CUIT: <ID>         ",
+    "Número brasileño: 123.456.789-00": "Número brasileño: <ID>          ",
+    "Cédula Venezuela: V-12345678": "Cédula Venezuela: <ID>      ",
+    "CI uruguaya: 1.234.567-8": "CI uruguaya: <ID>       ",
+    "Pasaporte chileno: C-12345678": "Pasaporte chileno: <ID>      ",
+    "Pasaporte mexicano: G-12345678": "Pasaporte mexicano: <ID>      ",
+    "Pasaporte argentino: AA-1234567": "Pasaporte argentino: <ID>      ",
+    "Número salvadoreño: SV-1234-123456-123-1":
+        "Número salvadoreño: <ID>                ",
+    "Número dominicano: RD-1-23-12345-6": "Número dominicano: <ID>           ",
+    "RTN Honduras: HN-1234-5678-12345": "RTN Honduras: <ID>              ",
+    "RUC Panamá: P-123-456-789": "RUC Panamá: <ID>         ",
+    "RUC Paraguay: 12345678A-9": "RUC Paraguay: <ID>       ",
+    "RUC Ecuador: EC-1790012345-001": "RUC Ecuador: <ID>             ",
+    "CI Nicaragua: 123-456789-1234A": "CI Nicaragua: <ID>            ",
+    "Número colombiano: COL-800123456-1": "Número colombiano: <ID>           ",
+    "Nota de débito 12345678-9": "Nota de débito <ID>      ",
+    "Código SII: 12.345.678-9": "Código SII: <ID>        ",
+    "Identificador: 20-12345678-1": "Identificador: <ID>         ",
+}
+# El resto del demo queda intacto. Incluye dos IDs que los patrones actuales
+# no cubren: el CURP de 18 caracteres (CURP_MEX admite 17) y el RUC peruano
+# de 11 dígitos (RUC_PER admite 10).
+
+
+def test_demo_outputs(engine):
+    for text in filter_ID.build_demo_dataset()["text"]:
+        expected = DEMO_MASKED.get(text, text)
+        assert filter_ID.replace_identifiers(text) == expected, text
+
+
+# --------------------------------------------------------------------------- #
+# Minúsculas y espacios duros                                                 #
+# --------------------------------------------------------------------------- #
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("CI 12345678-lp", "CI <ID>       "),
+        ("NIC 123-456789-1234a", "NIC <ID>            "),
+        ("RUC 12345678a-9", "RUC <ID>       "),
+        ("RIF j-12345678-9", "RIF <ID>        "),
+        ("RFC goñ8405121a1", "RFC <ID>        "),
+        ("cub-123456-54321", "<ID>            "),
+        # RUC_PAN también acepta "p": no debe ganarle al CI que sigue
+        ("p 12345678-LP", "p <ID>       "),
+        ("DPI 1234\xa056789\xa01234", "DPI <ID>           "),
+        ("RUT 12\u202f345\u202f678-9", "RUT <ID>        "),
+        ("CPF 123\xa0456\xa0789\xa000 y más", "CPF <ID>           y más"),
+    ],
+)
+def test_lowercase_and_nbsp(engine, text, expected):
+    assert filter_ID.replace_identifiers(text) == expected
+
+
+def test_other_unicode_spaces_are_not_separators(engine):
+    text = "DPI 1234\u200956789\u20091234"
+    assert filter_ID.replace_identifiers(text) == text
+
+
+# --------------------------------------------------------------------------- #
+# Candidatos solapados: gana el m\u00e1s largo                                     #
+# --------------------------------------------------------------------------- #
+# Salidas del filtro original (un finditer por patr\u00f3n, primero los m\u00e1s
+# largos). Con "gana el m\u00e1s a la izquierda" el candidato corto que empieza
+# antes (RUC_PAN, CUIT/RUT sobre un n\u00famero vecino) dejaba d\u00edgitos del ID
+# a la vista.
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("P 01-02-03-12345", "P <ID>          "),
+        ("10.000 1234 56789 1234", "10.000 <ID>           "),
+        ("9 2023 p 9 1234 1.234.567-8", "9 2023 p 9 1234 <ID>       "),
+        ("123.456.789-00 P 123 1234 01-02-03-12345",
+         "<ID>           P 123 1234 <ID>          "),
+        ("Folio P 12 12.345.678-9", "Folio P 12 <ID>        "),
+    ],
+)
+def test_overlaps_keep_longest(engine, text, expected):
+    assert filter_ID.replace_identifiers(text) == expected
+
+
+def test_no_pad_keeps_longest(engine):
+    table = pa.table({"text": ["P 01-02-03-12345", "10.000 1234 56789 1234",
+                               None, "Numero normal 3333"]})
+    out = filter_ID._replace_batch_arrow(table, col="text")["text"].to_pylist()
+    assert out == ["P <ID>", "10.000 <ID>", None, "Numero normal 3333"]
+
+
+# --------------------------------------------------------------------------- #
+# Equivalencia re / re2 ↔ Hyperscan                                           #
+# --------------------------------------------------------------------------- #
+_PREFIXES = ["", "", "", "SV", "HN", "EC", "CUB", "COL", "P", "RD", "CR",
+             "BO", "GT", "PE", "AA", "G", "C", "V", "J", "GOML", "GOM"]
+
+
+def _fuzz_texts(n, seed=0):
+    """Textos con forma de ID: prefijo, bloques de dígitos y separadores."""
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(n):
+        token = rng.choice(_PREFIXES) + rng.choice(["", "-", " "])
+        for i in range(rng.randint(1, 5)):
+            if i:
+                token += rng.choice("-. \xa0")
+            width = rng.randint(1, 10)
+            token += "".join(rng.choice("0123456789") for _ in range(width))
+        token += rng.choice(["", "", "k", "A", "lp", "HDFRRN0", "-9"])
+        lead, tail = rng.choice(["", "x ", "Nº "]), rng.choice(["", ".", " y"])
+        texts.append(lead + token + tail)
+    return texts
+
+
+@pytest.mark.skipif(filter_ID.HS_DB is None, reason="hyperscan no disponible")
+def test_hyperscan_matches_regex_path(monkeypatch):
+    texts = list(filter_ID.build_demo_dataset()["text"]) + _fuzz_texts(5000)
+    with_hs = [filter_ID.replace_identifiers(t) for t in texts]
+
+    monkeypatch.setattr(filter_ID, "HS_DB", None)
+    with_re = [filter_ID.replace_identifiers(t) for t in texts]
+
+    mismatches = [t for t, a, b in zip(texts, with_hs, with_re) if a != b]
+    assert not mismatches, mismatches[:5]